@@ -15,6 +15,22 @@ import csv
 from ast import literal_eval as make_tuple
 import networkx as nx
 import math
+import threading
+import time
+import multiprocessing
+import os
+import hashlib
+import inspect
+import weakref
+import json
+import Queue
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+try:
+    # spatial index for nearest node queries, see NodeIndex
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
 
 # Building footprint (plus street network) figure-ground diagrams
 #import matplotlib.pyplot as plt
@@ -52,7 +68,7 @@ with open('vacantosmnx', 'rb') as f:
 ################################################################################
 
 class OSMNX_Map(object):
-    def __init__(self, address='1516 Kenhill Ave, Baltimore, MD', radius=80, same = False):
+    def __init__(self, address='1516 Kenhill Ave, Baltimore, MD', radius=80, same = False, seed = None):
         
         self.address = address
         self.radius = radius
@@ -76,7 +92,7 @@ class OSMNX_Map(object):
         
         # initialize the model
         self.initial_housetype()
-        self.initial_storytype(same = same)
+        self.initial_storytype(same = same, seed = seed)
         
         # 
         self.Edge = self.GetEdgeSet_OSMNX()
@@ -134,20 +150,41 @@ class OSMNX_Map(object):
         self.gdf_proj = ox.project_gdf(self.gdf)
 
         
-    def initial_storytype(self, same = False):
+    def initial_storytype(self, same = False, seed = None):
         """
         update gdf by adding column 'housetype' take integer value
         
         if same is True, then only take integer value 2 in the column
         else randomly assign 2 or 3 into the column
+        seed( int ) : the random seed, Default is None. see storytype_scenarios
         """
         sLength = len(self.gdf[self.gdf.columns[0]])
         if not same:        
-            self.gdf = self.gdf.assign(storytype= np.random.randint(2,4,size = sLength))
+            self.gdf = self.gdf.assign(storytype= storytype_scenarios(sLength,[seed])[0])
         else:
             self.gdf = self.gdf.assign(storytype= np.random.randint(2,3,size = sLength))
             
         
+    def update_housetype(self, vacant = [], occupied = [], nontarget = []):
+        """
+        update gdf and houses sets when the vacancy list or the house classification changes
+        vacant( list(id) ) : houses became vacant ( housetype 2 )
+        occupied( list(id) ) : houses became occupied ( housetype 0, renter )
+        nontarget( list(id) ) : houses became not target ( housetype 3 )
+        
+        use ILP_sol.update_housetype with the same lists to patch the model, call it first since it raises
+        for the formulations it does not support
+        """
+        for housetype, houses in [(2,vacant),(0,occupied),(3,nontarget)]:
+            for i in houses:
+                if i in self.gdf.index:
+                    self.gdf.loc[i,'housetype'] = housetype
+                    
+        self.Owners = self.GetOwnerSet_OSMNX()
+        self.Renters = self.GetRenterSet_OSMNX()
+        self.Vacants = self.GetVacantSet_OSMNX()
+        
+        
     def GetEdgeSet_OSMNX(self):
         """
         Inport data: Edge550 - adjacent houses set in 
@@ -247,7 +284,9 @@ class OSMNX_Map(object):
              default_width=5, street_widths=None):
         """        
         plot the map
-        Parameters - x(model.x): default None, variables x after optimization
+        Parameters - x(ILP_sol): default None, the model after optimization, 
+                                 or model.x, or dict{id : x} e.g. model.get_solution()
+                                 pass the model if its solution may be from the result store
                      size(int) : default 9
                      name(string) : default 'temp_image', the saved image name
                      network_type(string) : default walk
@@ -313,7 +352,11 @@ class OSMNX_Map(object):
             
             # update color set
             # if x == 1 or very close to 1 (tolerance)
-            ec_after = ['mediumseagreen' if x[self.Houses[i]].X == 1.0 or abs(x[self.Houses[i]].X - 1.0) < 0.000001 
+            # the model itself, its solution may be from the result store, see ILP_sol.get_x
+            if isinstance(x, ILP_sol):
+                x = x.get_x()
+            x = {i : getattr(x[i],'X',x[i]) for i in self.Houses}
+            ec_after = ['mediumseagreen' if x[self.Houses[i]] == 1.0 or abs(x[self.Houses[i]] - 1.0) < 0.000001 
                         else ec[i] for i in xrange(len(self.Houses))]
             
             # get gdf_proj
@@ -341,26 +384,48 @@ class OSMNX_Map(object):
 #      Parameters - Houses(list(string)) : the index of houses set 
 #                   Edge(list(tuple))     
 #                   gdf(GEOdataFrame)
+#                   store(ResultStore)
+#                   env(gurobi Env)
 #      
 ################################################################################
             
 class ILP_sol(object):
-    def __init__(self, Houses, Edge, gdf = False):
+    def __init__(self, Houses, Edge, gdf = False, store = None, env = None):
         """        
         Houses( list(id) ): Houses set
         Edge( list((id_1,id_2)) ) : All pairs of adjacent houses
         gdf( GEOdataframe ) : Default is False, if using other types of data, then you should update the code
                               from line 365 to line 366.
+        store( ResultStore ) : Default is None. If given, solve() returns the stored result of the same inputs
+                               and the model is only built when the result is not in the store
+        env( gurobi Env ) : Default is None, use the default environment. 
+                            models solved in different threads need their own environment, see serve
         """
         
         self.Houses = Houses
         self.Edge = Edge        
         self.gdf = gdf
         
+        # result store, see update_key
+        self.store = store
+        self.key = None
+        self.static_key = None
+        self.built = False
+        # solution from the store, dict{id : x}, and the stored result
+        self.solution = None
+        self.result = None
+        # the solution set of each no good constraint
+        self.cuts = []
+        # houses fixed to x = 0 by the upper bound, see set_excluded
+        self.excluded = set()
+        
         # initial iterator
         self.iter = 0
         # initial status
         self.status = []
+        # callback for lazy constraints, see lazy_distance_callback
+        self.callback = None
+        self.lazy = []
         
         # if the input data type is not GEOdataframe
         if gdf is False:
@@ -370,7 +435,7 @@ class ILP_sol(object):
             # initial price
             self.initial_price()
             # initial gurobi model
-            self.model = Model()
+            self.model = Model() if env is None else Model(env = env)
             
             # initial variables
             self.x = self.model.addVars(Houses,vtype = GRB.BINARY,name = "x")
@@ -378,7 +443,7 @@ class ILP_sol(object):
             self.y = self.model.addVars(Edge,vtype = GRB.BINARY,name = "y")
             
             # if the building type >= 3, add constraint to set them all to be zero
-            notakedown = self.model.addConstrs((self.x[i] == 0 
+            self.notakedown = self.model.addConstrs((self.x[i] == 0 
                               for i in self.gdf[self.gdf['housetype'] >= 3].index
                              ),name = "notakedown")
             # model update
@@ -420,11 +485,7 @@ class ILP_sol(object):
             gdf = self.gdf
             
             # cost for demolishing house i for i in houses set
-            self.Cost = [( self.demolish_2_story if gdf['storytype'][i] == 2 else 0 ) +
-                         ( self.demolish_3_story if gdf['storytype'][i] == 3 else 0 ) +
-                         ( self.r_relocate       if gdf['housetype'][i] == 0 else 0 ) +
-                         ( self.o_relocate       if gdf['housetype'][i] == 1 else 0 ) 
-                           for i in self.Houses]
+            self.Cost = [self.house_cost(i) for i in self.Houses]
             
             # cost for wall
             self.Wallij = [( self.wall_2_story/2 if gdf['storytype'][item[0]] == 2 else 0 ) +
@@ -445,11 +506,60 @@ class ILP_sol(object):
             
             # benefit
             self.Benefit = [ self.cost_reduction for i in xrange(len(self.Edge))]
+            
+            
+    def get_price(self):
+        """
+        return dict of the parameters of initial_price
+        """
+        return {'Budget' : self.Budget, 'demolish_2_story' : self.demolish_2_story, 
+                'demolish_3_story' : self.demolish_3_story, 'r_relocate' : self.r_relocate,
+                'o_relocate' : self.o_relocate, 'wall_2_story' : self.wall_2_story, 
+                'wall_3_story' : self.wall_3_story, 'cost_reduction' : self.cost_reduction}
+    
+    
+    def set_storytype(self, storytype):
+        """
+        change the storytype of houses and update the budget constraint, the rest of the model is kept
+        storytype( array ) : storytype of each row of gdf, see storytype_scenarios
+        """
+        if not self.built:
+            self.build()
+        self.gdf = self.gdf.assign(storytype = storytype)
+        self.set_budget()
+        self.update_budget_constraint()
+        self.update_key()
+        
+        
+    def update_budget_constraint(self):
+        """
+        set the coefficients and the rhs of the budget constraint from Cost, Wallij, Walli, Wallj and Budget
+        """
+        coeff = {self.Houses[k] : self.Cost[k] for k in xrange(len(self.Houses))}
+        for e in xrange(len(self.Edge)):
+            coeff[self.Edge[e][0]] -= self.Walli[e]
+            coeff[self.Edge[e][1]] -= self.Wallj[e]
+            self.model.chgCoeff(self.Budget_Constraint, self.z[self.Edge[e]], self.Wallij[e])
+            
+        for i in coeff:
+            self.model.chgCoeff(self.Budget_Constraint, self.x[i], coeff[i])
+        self.Budget_Constraint.RHS = self.Budget - sum(self.Walli) - sum(self.Wallj)
+        
+        
+    def house_cost(self, i):
+        """
+        cost for demolishing house i, depends on the storytype and the housetype of house i
+        """
+        gdf = self.gdf
+        return (( self.demolish_2_story if gdf['storytype'][i] == 2 else 0 ) +
+                ( self.demolish_3_story if gdf['storytype'][i] == 3 else 0 ) +
+                ( self.r_relocate       if gdf['housetype'][i] == 0 else 0 ) +
+                ( self.o_relocate       if gdf['housetype'][i] == 1 else 0 ))
     
     
     def update_model_OSMNX(self,d ,h,
                            CompareHouses = False, Max = False, d_e = 30, power = 1, 
-                           delta_method = True, model = 2):
+                           delta_method = True, model = 2, k = 8, index = None, geocode_options = {}):
         """        
         update momdel
         [ can be simplified ] 
@@ -462,9 +572,51 @@ class ILP_sol(object):
         power( int ) : the power of weight function ( 1/2^power ). Default is 1.
                        if power is 0. The weight function will be an indicator function
         delta_method( bool ) : If true use delta_method( O(n^2) space, no tolerance ). Default is True
+                               o.w. maximize the distance t_o to the closest non-demolished vacant house
+        k( int ) : the number of nearest vacant houses for each occupied house if delta_method is False.
+                   Default is 8. If None, use all vacant houses. Only used with d = distance_OSMNX
+        index( InfluenceIndex ) : the neighbor index of model 2 with h = affect_OSMNX. Default is None,
+                                  build one with max_d_e = d_e. Share one index with max_d_e >= all d_e 
+                                  to compute the distances only once for many d_e. An index of other 
+                                  occupied or vacant houses is not used, a new one is built
+        geocode_options( dict ) : arguments of geocode_batch for model 3, e.g. {'rate' : 1.0, 'retries' : 3}
         model( int ) : Can be either 1,2 or 3. [ to be filled ]. Default is 2
         """
         
+        # look up the result store before building the model
+        # if the result is stored, the model is built in solve() only when it's needed
+        self.options = dict(d = d, h = h, CompareHouses = CompareHouses, Max = Max, d_e = d_e, power = power,
+                            delta_method = delta_method, model = model, k = k)
+        self.index = index
+        self.geocode_options = geocode_options
+        
+        # keep the formulation, see update_housetype
+        self.d = d
+        self.h = h
+        self.Max = Max
+        self.d_e = d_e
+        self.power = power
+        self.delta_method = delta_method
+        self.model_num = model
+        
+        # to get the unique occupied houses set
+        #                    vacant  houses set
+        # [ can be improved ] 
+        occupied = [item[0] for item in CompareHouses]
+        occupied = np.unique(occupied)
+        vacant = [item[1] for item in CompareHouses]
+        vacant = np.unique(vacant)
+        self.occupied = occupied.tolist()
+        self.vacant = vacant.tolist()
+        # the result key uses the houses sets, the pairs only for model 1, see pairs_key
+        self.pairs = pairs_key(self.options)
+        
+        if self.store is not None and not self.built:
+            self.update_key()
+            if self.store.get(self.get_key()) is not None:
+                return
+        self.built = True
+        
         Houses = self.Houses
         Edge = self.Edge
         Cost = self.Cost
@@ -473,9 +625,8 @@ class ILP_sol(object):
         Wallj = self.Wallj
         Benefit = self.Benefit
         
-        
         # budget constraint
-        Budget_Constraint = self.model.addConstr((quicksum(Cost[i]*self.x[Houses[i]] for i in xrange(len(Houses))) +
+        self.Budget_Constraint = self.model.addConstr((quicksum(Cost[i]*self.x[Houses[i]] for i in xrange(len(Houses))) +
                              quicksum(Wallij[i]*self.z[Edge[i]] for i in xrange(len(Edge))) -
                              quicksum(Benefit[i]*self.y[Edge[i]] for i in xrange(len(Edge))) -
                              quicksum(Walli[i]*self.x[Edge[i][0]] for i in xrange(len(Edge))) -
@@ -517,15 +668,6 @@ class ILP_sol(object):
         
         
         
-        # to get the unique occupied houses set
-        #                    vacant  houses set
-        # [ can be improved ] 
-        occupied = [item[0] for item in CompareHouses]
-        occupied = np.unique(occupied)
-        vacant = [item[1] for item in CompareHouses]
-        vacant = np.unique(vacant)
-        
-        
         # there are three model
         # 1 : original delta method
         # 2 : 
@@ -581,21 +723,21 @@ class ILP_sol(object):
                 self.bigM = self.model.addVars(occupied,vtype = GRB.CONTINUOUS,name = "bigM",lb = -GRB.INFINITY, ub = 0.0)
                 
                 
+                # the weights of affect_OSMNX are prefix slices of the neighbor index
+                # an index built for other houses sets or a smaller d_e is built again
+                if h is affect_OSMNX:
+                    if self.index is None:
+                        self.index = InfluenceIndex(self.gdf, CompareHouses, d_e)
+                    elif self.index.max_d_e < d_e or not self.index.matches(self.occupied, self.vacant):
+                        self.build_index(max(d_e, self.index.max_d_e))
+                    
                 # set constrain for bigM variables
-                test_count = 0
+                # weight[o] : dict{v : h(o,v)} - nonzero weights of occupied house o
+                # influence[o] : the bigM constraint of occupied house o
+                self.weight = {}
+                self.influence = {}
                 for o in occupied:
-                    
-                    # normal by total
-                    total = sum( h(self.gdf['centroid'][o].coords[0]
-                                           ,self.gdf['centroid'][v].coords[0],d_e,power) for v in vacant)
-                    devide = 1.0 if total == 0 else total
-                    
-                    self.model.addConstr(( self.bigM[o] <= quicksum(h(self.gdf['centroid'][o].coords[0]
-                                                        ,self.gdf['centroid'][v].coords[0],d_e,power)*(self.x[v]-1) 
-                                                                    for v in vacant)
-                                          + 
-                                            total*self.x[o] ) , 
-                                    name = "for each occupied")
+                    self.add_influence(o)
                     
                 # set objective function
                 # notice that for each bigM constraint 
@@ -613,18 +755,16 @@ class ILP_sol(object):
                 #occupied = [item[0] for item in CompareHouses]
                 #occupied = np.unique(occupied)
                 self.bigM = self.model.addVars(occupied,vtype = GRB.CONTINUOUS,name = "bigM",lb = -GRB.INFINITY, ub = 0.0)
-                
-                
+
+                # geocode all distinct addresses in one batch, and snap them to G in one query
+                # geometry_distance will read them from geocode_cache and snap_cache
+                points = geocode_houses(self.gdf, list(occupied) + list(vacant), **geocode_options)
+                snap_houses(self.gdf, points.keys(), points)
+
+                self.weight = {}
+                self.influence = {}
                 for o in occupied:
-                    
-                    self.model.addConstr(( self.bigM[o] <= quicksum(
-                        h(d_e = d_e,power = power,
-                          gdf1 = self.gdf.loc[[o]], gdf2 = self.gdf.loc[[v]])*(self.x[v]-1) 
-                                                                    for v in vacant) + 
-                                            sum(h(d_e = d_e,power = power,
-                                                  gdf1 = self.gdf.loc[[o]], 
-                                                  gdf2 = self.gdf.loc[[v]]) for v in vacant)*self.x[o] ) , 
-                                    name = "for each occupied")
+                    self.add_influence(o)
                 # set objective function
                 # notice that for each bigM constraint 
                 # the maximization will be 0 which means there is no any effect on the occupied house
@@ -642,42 +782,410 @@ class ILP_sol(object):
             # set new variable t_i correspond to i-th occupied house
             self.t = self.model.addVars(occupied,vtype = GRB.CONTINUOUS,name = "t")
             
+            # point[i] : (lat,lng) of house i, centroid is (lng,lat)
+            self.point = {i : (self.gdf['centroid'][i].coords[0][1],self.gdf['centroid'][i].coords[0][0]) 
+                          for i in list(occupied) + list(vacant)}
+            
+            # only the k nearest vacant houses of each occupied house are candidates
+            # the other pairs are added by lazy_distance_callback when they become binding
+            # the KD-tree is on the unit sphere, so only the great circle distance ( distance_OSMNX ) is pruned
+            if d is distance_OSMNX and cKDTree is not None and k is not None and k < len(vacant):
+                self.unit = dict(zip(list(occupied) + list(vacant), 
+                                     to_unit_sphere([self.point[i][0] for i in list(occupied) + list(vacant)],
+                                                    [self.point[i][1] for i in list(occupied) + list(vacant)])))
+                unit_v = np.array([self.unit[v] for v in vacant]).reshape(-1,3)
+                self.vacant_tree = cKDTree(unit_v)
+                self.model.Params.LazyConstraints = 1
+                self.callback = lazy_distance_callback
+                self.model._sol = self
+                
             # set the constraint
-            # notive that the distance is geometry_distance here
+            # t_o <= d_ov*(1-x_v) + M_o*x_v for each candidate pair
+            # where M_o is the distance to the farthest vacant house, so t_o <= M_o in any case
+            self.M = {}
+            self.candidates = {}
             for o in occupied:
                 
-                self.model.addConstrs(( self.t[o] <= d(
-                                                       (self.gdf['centroid'][o].coords[0][1],
-                                                        self.gdf['centroid'][o].coords[0][0])
-                                                      ,(self.gdf['centroid'][v].coords[0][1],
-                                                        self.gdf['centroid'][o].coords[0][0])
-                                                      )* (1-self.x[v]) + (10000000000)*self.x[v]
-                                        for v in vacant
+                if self.callback is not None:
+                    # chord^2 = 2 - 2*(u_o.u_v) on the unit sphere
+                    # with a margin for the rounding of distance_OSMNX, so M_o >= d_ov for all v
+                    self.M[o] = float(chord_to_meters(np.sqrt(max(2.0-2.0*unit_v.dot(self.unit[o]).min(),0.0))))\
+                                *(1+1e-9) + 1e-6
+                    # query returns a scalar index if k is 1
+                    self.candidates[o] = set(vacant[np.atleast_1d(self.vacant_tree.query(self.unit[o], k = k)[1])])
+                    dis = {v : d(self.point[o],self.point[v]) for v in self.candidates[o]}
+                else:
+                    # all vacant houses are candidates, M_o is computed with d itself
+                    self.candidates[o] = set(vacant)
+                    dis = {v : d(self.point[o],self.point[v]) for v in self.candidates[o]}
+                    self.M[o] = max(dis.values()) if len(dis) != 0 else 0.0
+                self.t[o].UB = self.M[o]
+                    
+                self.model.addConstrs(( self.distance_constr(o,v,dis[v]) for v in self.candidates[o]
                                       ), name = str(o)+"Constraint"
                                      ) 
                 
-                self.model.addConstr(( self.t[h] <= 10000000000*(1-self.x[h])), name = str(h))
+                self.model.addConstr(( self.t[o] <= self.M[o]*(1-self.x[o])), name = str(o))
             
             # set objective function
             self.model.setObjective( quicksum(self.t[i] for i in occupied), GRB.MAXIMIZE)
             
         
+    def distance_constr(self, o, v, dis = None):
+        """
+        the constraint of occupied house o and vacant house v in the max-min distance formulation
+            t_o <= d_ov*(1-x_v) + M_o*x_v
+        dis( float ) : d_ov if it is computed already
+        """
+        dis = self.d(self.point[o],self.point[v]) if dis is None else dis
+        return self.t[o] <= dis + max(self.M[o]-dis,0.0)*self.x[v]
+    
+    
+    def add_lazy_distance(self):
+        """
+        called by lazy_distance_callback for each new solution
+        for each occupied house o, find the closest non-demolished vacant house v within t_o
+        which is not a candidate yet, and add the constraint of (o,v) if it is violated
+        """
+        x = dict(zip(self.Houses, self.model.cbGetSolution([self.x[i] for i in self.Houses])))
+        t = dict(zip(self.occupied, self.model.cbGetSolution([self.t[o] for o in self.occupied])))
+        
+        for o in self.occupied:
+            if x[o] > 0.5:
+                continue
+            
+            # all vacant houses within t_o, chord = 2*sin(d/2R)
+            chord = 2.0*math.sin(min(t[o]/2.0/EARTH_RADIUS,math.pi/2))
+            close = [self.vacant[j] for j in self.vacant_tree.query_ball_point(self.unit[o],chord*(1+1e-9))]
+            close = [(self.d(self.point[o],self.point[v]),v) for v in close 
+                     if x[v] < 0.5 and v not in self.candidates[o]]
+            
+            if len(close) != 0:
+                dis, v = min(close)
+                if dis < t[o] - 0.000001:
+                    self.candidates[o].add(v)
+                    self.lazy.append((o,v))
+                    self.model.cbLazy(self.distance_constr(o,v))
+                    
+                    
+    def get_weight(self, o, v):
+        """
+        weight of vacant house v on occupied house o
+        model 3 calls h with the walking distance ( geometry_distance ) of the two houses
+        """
+        if self.model_num == 3:
+            return self.h(d_e = self.d_e,power = self.power,
+                          gdf1 = self.gdf.loc[[o]], gdf2 = self.gdf.loc[[v]])
+        return self.h(self.gdf['centroid'][o].coords[0],self.gdf['centroid'][v].coords[0],self.d_e,self.power)
+    
+    
+    def use_index(self):
+        """
+        return True if the weights of model 2 are prefix slices of the neighbor index
+        """
+        return (self.model_num == 2 and self.h is affect_OSMNX and self.index is not None 
+                and self.d_e <= self.index.max_d_e)
+    
+    
+    def build_index(self, max_d_e):
+        """
+        build the neighbor index of model 2 for the current occupied and vacant houses, see InfluenceIndex
+        """
+        self.index = InfluenceIndex(self.gdf, [(o,v) for o in self.occupied for v in self.vacant], max_d_e)
+        
+        
+    def get_weights(self, o):
+        """
+        return dict{v : h(o,v)} of nonzero weights of occupied house o
+        use the neighbor index of model 2 if there is one
+        """
+        if self.use_index():
+            return self.index.get_weights(o, self.d_e, self.power)
+        
+        # weight of each vacant house, computed once per pair
+        weight = {v : self.get_weight(o,v) for v in self.vacant}
+        return {v : weight[v] for v in weight if weight[v] != 0}
+    
+    
+    def add_influence(self, o):
+        """
+        add the bigM constraint of occupied house o
+            bigM_o <= sum_v h(o,v)*(x_v-1) + total*x_o    where total = sum_v h(o,v)
+        """
+        self.weight[o] = self.get_weights(o)
+        
+        # normal by total
+        total = self.get_total(o)
+        
+        self.influence[o] = self.model.addConstr(( self.bigM[o] <= quicksum(self.weight[o][v]*(self.x[v]-1) 
+                                                                          for v in self.weight[o])
+                                                  + 
+                                                    total*self.x[o] ) , 
+                                            name = "for each occupied")
+        
+        
+    def get_total(self, o):
+        """
+        return the normalizer total of occupied house o, the sum of its weights
+        use the cumulative weights of the neighbor index of model 2 if there is one
+        """
+        if self.use_index():
+            return self.index.get_total(o, self.d_e, self.power)
+        return sum(self.weight[o].values())
+    
+    
+    def set_weights(self, o):
+        """
+        change all weights in the bigM constraint of occupied house o to the current d_e, see get_weights
+        """
+        weight = self.get_weights(o)
+        row = self.influence[o]
+        for v in set(self.weight[o]) - set(weight):
+            self.model.chgCoeff(row, self.x[v], 0.0)
+            
+        self.weight[o] = weight
+        for v in self.weight[o]:
+            self.model.chgCoeff(row, self.x[v], -self.weight[o][v])
+            
+        total = self.get_total(o)
+        self.model.chgCoeff(row, self.x[o], -total)
+        row.RHS = -total
+        
+        
+    def set_effective_distance(self, d_e):
+        """
+        change the effective distance d_e, only the coefficients of the bigM constraints are changed
+        only the delta method with model 2 or 3 is supported
+        """
+        if not self.built:
+            self.build()
+        if not self.delta_method or self.model_num not in [2,3]:
+            print "to be updated"
+            return
+        
+        self.d_e = d_e
+        self.options['d_e'] = d_e
+        # a larger d_e than the neighbor index, build the index again
+        if self.index is not None and self.index.max_d_e < d_e:
+            self.build_index(d_e)
+        for o in self.occupied:
+            self.set_weights(o)
+        self.update_key()
+        
+        
+    def set_Budget(self, Budget):
+        """
+        change the budget, only the rhs of the budget constraint is changed
+        """
+        self.Budget = Budget
+        if self.built:
+            self.Budget_Constraint.RHS = self.Budget - sum(self.Walli) - sum(self.Wallj)
+        self.update_key()
+        
+        
+    def set_excluded(self, exclude):
+        """
+        fix x_i = 0 for each house i in exclude by the upper bound, houses excluded before are released
+        exclude( list(id) )
+        """
+        exclude = set(i for i in exclude if i in self.x)
+        for i in self.excluded - exclude:
+            self.x[i].UB = 1.0
+        for i in exclude - self.excluded:
+            self.x[i].UB = 0.0
+        self.excluded = exclude
+        self.update_key()
+        
+        
+    def set_influence(self, o, v, w):
+        """
+        change the weight of vacant house v in the bigM constraint of occupied house o
+        the constraint is stored as  bigM_o - sum_v w_v*x_v - total*x_o <= -total
+        """
+        if w == 0:
+            self.weight[o].pop(v,None)
+        else:
+            self.weight[o][v] = w
+        total = sum(self.weight[o].values())
+        
+        row = self.influence[o]
+        self.model.chgCoeff(row, self.x[v], -w)
+        self.model.chgCoeff(row, self.x[o], -total)
+        row.RHS = -total
+        
+        
+    def update_housetype(self, vacant = [], occupied = [], nontarget = []):
+        """
+        patch the model when the vacancy list or the house classification changes, then the next solve()
+        starts from the previous solution
+        vacant( list(id) ) : houses became vacant ( housetype 2 )
+        occupied( list(id) ) : houses became occupied ( housetype 0, renter )
+        nontarget( list(id) ) : houses became not target ( housetype 3 )
+        
+        only the delta method with model 2 or 3 is supported, other models raise NotImplementedError
+        before anything is changed
+        note that gdf is shared with OSMNX_Map, call this before OSMNX_Map.update_housetype
+        """
+        if not self.delta_method or self.model_num not in [2,3]:
+            raise NotImplementedError("update_housetype only supports the delta method with model 2 or 3")
+        if not self.built:
+            self.build()
+        
+        # keep the previous solution before changing the model
+        start = {i : self.x[i].X for i in self.Houses} if self.model.SolCount > 0 else {}
+        self.model.update()
+        # the neighbor index is for the previous houses sets, use h while patching and build it again at the end
+        index = self.index if self.use_index() else None
+        self.index = None
+        
+        changes = dict([(i,2) for i in vacant] + [(i,0) for i in occupied] + [(i,3) for i in nontarget])
+        house_index = {self.Houses[k] : k for k in xrange(len(self.Houses))}
+        
+        for i, housetype in changes.items():
+            if i not in house_index:
+                continue
+            
+            # remove house i from its previous role in the model
+            if i in self.weight:
+                self.model.remove(self.influence.pop(i))
+                self.model.remove(self.bigM[i])
+                del self.bigM[i]
+                del self.weight[i]
+                self.occupied.remove(i)
+            elif i in self.vacant:
+                self.vacant.remove(i)
+                for o in self.occupied:
+                    if i in self.weight[o]:
+                        self.set_influence(o,i,0)
+            elif i in self.notakedown:
+                self.model.remove(self.notakedown[i])
+                del self.notakedown[i]
+                
+            # update the cost of house i in the budget constraint
+            # the cost of walls only depends on storytype
+            self.gdf.loc[i,'housetype'] = housetype
+            k = house_index[i]
+            cost = self.house_cost(i)
+            self.model.chgCoeff(self.Budget_Constraint, self.x[i], 
+                                self.model.getCoeff(self.Budget_Constraint, self.x[i]) + cost - self.Cost[k])
+            self.Cost[k] = cost
+            
+            # add house i with its new role
+            if housetype == 2:
+                self.vacant.append(i)
+                for o in self.occupied:
+                    w = self.get_weight(o,i)
+                    if w != 0:
+                        self.set_influence(o,i,w)
+            elif housetype == 0:
+                self.occupied.append(i)
+                self.bigM[i] = self.model.addVar(vtype = GRB.CONTINUOUS,name = "bigM[%s]" %i,
+                                                 lb = -GRB.INFINITY, ub = 0.0, obj = 1.0)
+                self.add_influence(i)
+            else:
+                self.notakedown[i] = self.model.addConstr(self.x[i] == 0, name = "notakedown[%s]" %i)
+                start[i] = 0
+                
+        if index is not None:
+            self.build_index(index.max_d_e)
+            
+        # warm start
+        for i in start:
+            self.x[i].Start = start[i]
+        self.model.update()
+        self.update_key()
+        
+        
+    def update_key(self):
+        """
+        update the key of the inputs in the result store, see result_key
+        """
+        if self.store is not None:
+            # houses, edges and centroids do not change, hash them once
+            if self.static_key is None:
+                self.static_key = static_key(self.gdf, self.Houses, self.Edge)
+            options = dict(self.options)
+            options['CompareHouses'] = self.pairs
+            if len(self.excluded) != 0:
+                options['exclude'] = sorted(self.excluded)
+            self.key = result_key(self.static_key, self.gdf, self.Houses, self.occupied, self.vacant, 
+                                  self.get_price(), options)
+            
+            
+    def get_key(self):
+        """
+        return the key of the next solution, the no good constraints so far are part of the key
+        """
+        return hashlib.sha1(self.key + repr(self.cuts)).hexdigest()
+    
+    
+    def build(self):
+        """
+        build the model skipped by update_model_OSMNX, and add the no good constraints so far
+        """
+        self.built = True
+        self.update_model_OSMNX(index = self.index, geocode_options = self.geocode_options, **self.options)
+        for S in self.cuts:
+            self.add_no_good(S)
+            
+            
     def solve(self):
         """        
         solve the optimzation problem
+        if there is a result store, return the stored result of the same inputs
         """
-        self.model.optimize()
+        if self.store is not None:
+            result = self.store.get(self.get_key())
+            if result is not None:
+                self.solution = dict(zip(self.Houses, result['x']))
+                self.result = result
+                self.status_update(result)
+                return
+            if not self.built:
+                self.build()
+        self.solution = None
+        self.result = None
+        
+        if self.callback is None:
+            self.model.optimize()
+        else:
+            self.model.optimize(self.callback)
+            
+            # keep the lazy constraints in the model for the next solve
+            for o, v in self.lazy:
+                self.model.addConstr(self.distance_constr(o,v), name = str(o)+"Constraint")
+            self.lazy = []
         
         # update the status : the max/min of objective functions, and sum of deolished houses set
         self.status_update()
         
+        # only optimal solutions are stored, a time limit or an interrupt may give a different one next time
+        if self.store is not None and self.model.Status == GRB.OPTIMAL:
+            self.store.put(self.get_key(), [self.x[i].X for i in self.Houses], 
+                           self.model.ObjVal, self.get_spent(), self.model.Runtime)
+        
         
     def get_x(self):
         """        
-        return binary variables
+        return binary variables, or dict{id : x} if the solution is from the result store
         """
+        if self.solution is not None:
+            return self.solution
         return self.x
     
+    
+    def get_result(self):
+        """
+        return dict of the current solution, from the model or from the result store
+            x : dict{id : x}
+            ObjVal, spent, Runtime : float
+        """
+        if self.solution is not None:
+            return {'x' : self.solution, 'ObjVal' : float(self.result['ObjVal']), 
+                    'spent' : float(self.result['spent']), 'Runtime' : float(self.result['Runtime'])}
+        return {'x' : self.get_solution(), 'ObjVal' : self.model.ObjVal, 
+                'spent' : self.get_spent(), 'Runtime' : self.model.Runtime}
+    
     def no_good_update(self):
         
         """        
@@ -688,34 +1196,61 @@ class ILP_sol(object):
         """
         # 10/26 deal with tolerance
         # check if the solution is non-zero
-        if sum(self.x[self.Houses[i]].X for i in xrange(len(self.Houses))) != 0:
+        x = self.get_solution()
+        if sum(x[self.Houses[i]] for i in xrange(len(self.Houses))) != 0:
             
             self.iter += 1
-            self.model.addConstr(
-                (
-                quicksum(self.x[self.Houses[i]] 
-                         if self.x[self.Houses[i]].X == 1 or abs(self.x[self.Houses[i]].X - 1.0) < 0.000001 
-                         else 0 for i in xrange(len(self.Houses)))
-                <= sum( 1
-                       if self.x[self.Houses[i]].X == 1 or abs(self.x[self.Houses[i]].X - 1.0) < 0.000001 
-                       else 0 for i in xrange(len(self.Houses)))-1
-                ),name = 'temp'
-            )
-
-            
-    def status_update(self):
+            S = [i for i in self.Houses if x[i] == 1 or abs(x[i] - 1.0) < 0.000001]
+            self.cuts.append(S)
+            # if the model is not built yet, the constraint is added in build()
+            if self.built:
+                self.add_no_good(S)
+                
+                
+    def add_no_good(self, S):
+        """
+        add the no good constraint of the solution set S - sum_{i in S} x_i <= |S|-1
+        """
+        self.model.addConstr((quicksum(self.x[i] for i in S) <= len(S)-1), name = 'temp')
+        
+        
+    def get_solution(self):
+        """
+        return dict{id : x} of the current solution, from the model or from the result store
+        """
+        if self.solution is not None:
+            return self.solution
+        return {i : self.x[i].X for i in self.Houses}
+
+            
+    def get_spent(self):
+        """
+        return the spent budget of the current solution, from the model or from the result store
+        """
+        if self.solution is not None:
+            return float(self.result['spent'])
+        return (sum(self.Cost[i]*self.x[self.Houses[i]].X for i in xrange(len(self.Houses))) +
+         sum(self.Wallij[i]*self.z[self.Edge[i]].X for i in xrange(len(self.Edge))) -
+         sum(self.Benefit[i]*self.y[self.Edge[i]].X for i in xrange(len(self.Edge))) -
+         sum(self.Walli[i]*self.x[self.Edge[i][0]].X for i in xrange(len(self.Edge))) -
+         sum(self.Wallj[i]*self.x[self.Edge[i][1]].X for i in xrange(len(self.Edge))) )
+    
+    
+    def status_update(self, result = None):
         """        
         get the solution detail
             Budget
             number of demolished houses 
             Objective Value
             Running Time
+        result( dict ) : Default is None. the result from the result store
         """
-        spent = (sum(self.Cost[i]*self.x[self.Houses[i]].X for i in xrange(len(self.Houses))) +
-         sum(self.Wallij[i]*self.z[self.Edge[i]].X for i in xrange(len(self.Edge))) -
-         sum(self.Benefit[i]*self.y[self.Edge[i]].X for i in xrange(len(self.Edge))) -
-         sum(self.Walli[i]*self.x[self.Edge[i][0]].X for i in xrange(len(self.Edge))) -
-         sum(self.Wallj[i]*self.x[self.Edge[i][1]].X for i in xrange(len(self.Edge))) )
+        if result is not None:
+            self.status.append("Budget : %s   number of houses : %s   ObjVal : %s   Running Time : %s (stored)" %(
+                result['spent'], result['x'].sum(), result['ObjVal'], result['Runtime']))
+            return
+        
+        spent = self.get_spent()
         
         num_houses = sum(self.x[self.Houses[i]].X  for i in xrange(len(self.Houses)))
     
@@ -741,13 +1276,35 @@ class ILP_sol(object):
 #
 ################################################################################
 
-# initial network map
-G = ox.graph_from_address('1516 Kenhill Ave, Baltimore, MD', network_type= 'walk', distance = 1000)
-# project the street network to UTM
-G_proj = ox.project_graph(G)
-nodes = ox.graph_to_gdfs(G, edges=False)
+# initial network map, downloaded at the first call of get_walk_graph
+# only the walking distance ( model 3 ) needs it
+G = None
+G_proj = None
+nodes = None
+
 
+def get_walk_graph():
+    """
+    return the walk graph G, download it at the first call
+    """
+    global G, G_proj, nodes
+    if G is None:
+        G = ox.graph_from_address('1516 Kenhill Ave, Baltimore, MD', network_type= 'walk', distance = 1000)
+        # project the street network to UTM
+        G_proj = ox.project_graph(G)
+        nodes = ox.graph_to_gdfs(G, edges=False)
+    return G
 
+
+def lazy_distance_callback(model, where):
+    """
+    gurobi callback, add the omitted pairs of the max-min distance formulation 
+    when they become binding, see ILP_sol.add_lazy_distance
+    """
+    if where == GRB.Callback.MIPSOL:
+        model._sol.add_lazy_distance()
+        
+        
 def distance_OSMNX(x,y):
     # x,y - tuples
     # lat1,lng1,lat2,lng2,earth_radius
@@ -770,7 +1327,8 @@ def affect_OSMNX(x1=None,x2=None,d_e = 30,power = 1,gdf1 = None, gdf2 = None):
     alpha = 1.0
     
     # unit: meter
-    return 1.0*alpha/(dis**power) if dis <= d_e else 0
+    # no effect if there is no distance, see geometry_distance
+    return 1.0*alpha/(dis**power) if dis is not None and dis <= d_e else 0
 
 
 def geometry_distance(gdf1,gdf2):
@@ -778,20 +1336,23 @@ def geometry_distance(gdf1,gdf2):
     
 
     # get_name
-    s_name = gdf1['addr:housenumber'][gdf1.index[0]] + " " + gdf1['addr:street'][gdf1.index[0]]\
-            + ", " + gdf1['addr:city'][gdf1.index[0]] + ", " +  gdf1['addr:state'][gdf1.index[0]]
-    t_name = gdf2['addr:housenumber'][gdf2.index[0]] + " " + gdf2['addr:street'][gdf2.index[0]]\
-            + ", " + gdf2['addr:city'][gdf2.index[0]] + ", " +  gdf2['addr:state'][gdf2.index[0]]
+    s_name = get_address(gdf1,gdf1.index[0])
+    t_name = get_address(gdf2,gdf2.index[0])
         
         
     
     #s = ox.core.graph_from_address(s_name, distance = 100,return_coords=True)[1] # return (lat,log)
     #t = ox.core.graph_from_address(t_name, distance = 100,return_coords=True)[1] # return (lat,log)
     
-    s = ox.utils.geocode(s_name) # return (lat,log)
-    t = ox.utils.geocode(t_name) # return (lat,log)
+    # look up geocode_cache first, see geocode_houses
+    s = geocode(s_name) # return (lat,log)
+    t = geocode(t_name) # return (lat,log)
+    # no distance if the address is missing or failed
+    if s is None or t is None:
+        return None
     
     
+    get_walk_graph()
     s_node, s_dis = find_nearest_point(s) # distance in meters
     t_node, t_dis = find_nearest_point(t) # distance in meters
     
@@ -839,7 +1400,738 @@ def geometry_distance(gdf1,gdf2):
     
     
 def find_nearest_point(node):
-    return ox.get_nearest_node(G, node
-                             ,method = 'greatcircle' ,return_dist=True
-                            )
+    """
+    get the nearest node in G of the point node (lat,lng)
+    return (node id, distance in meters), see snap_houses to snap many points at once
+    """
+    if node not in snap_cache:
+        nearest, dis = find_nearest_points([node])
+        snap_cache[node] = (nearest[0], dis[0])
+    return snap_cache[node]
+
+
+
+################################################################################
+#
+# Nearest Node Index
+#       ox.get_nearest_node computes the great circle distance to every node
+#       of the graph for each point. NodeIndex builds a KD-tree once per graph
+#       on the unit sphere coordinates of the nodes. The chord length is 
+#       monotonic in the great circle distance, so the nearest node is the 
+#       same as method = 'greatcircle'
+#
+################################################################################
+
+# earth radius in meters, same as ox.utils.great_circle_vec
+EARTH_RADIUS = 6371009
+
+# snap_cache : dict{(lat,lng) : (node id, distance)} - snapped points
+snap_cache = {}
+# node_indexes : dict{graph : NodeIndex} - one index per graph, dropped with the graph
+node_indexes = weakref.WeakKeyDictionary()
+
+
+def to_unit_sphere(lat,lng):
+    """
+    convert arrays of lat,lng in degrees into an array (n,3) of points on the unit sphere
+    """
+    lat = np.radians(np.asarray(lat,dtype = float))
+    lng = np.radians(np.asarray(lng,dtype = float))
+    return np.column_stack((np.cos(lat)*np.cos(lng), np.cos(lat)*np.sin(lng), np.sin(lat)))
+
+
+def chord_to_meters(chord):
+    """
+    convert the chord length on the unit sphere into great circle distance in meters
+    """
+    return 2.0*EARTH_RADIUS*np.arcsin(np.clip(np.asarray(chord)/2.0,0.0,1.0))
+
+
+class NodeIndex(object):
+    """
+    KD-tree on the nodes of graph
+    graph( networkx graph ) : unprojected graph, nodes have attribute 'x' (lng) and 'y' (lat)
+    """
+    def __init__(self, graph):
+        lat = nx.get_node_attributes(graph,'y')
+        lng = nx.get_node_attributes(graph,'x')
+        self.ids = np.array(list(lat.keys()))
+        self.tree = cKDTree(to_unit_sphere([lat[n] for n in self.ids],[lng[n] for n in self.ids]))
+        
+    def query(self, points):
+        """
+        points( list((lat,lng)) )
+        return (array of node ids, array of distances in meters)
+        """
+        points = np.asarray(points,dtype = float).reshape(-1,2)
+        chord, idx = self.tree.query(to_unit_sphere(points[:,0],points[:,1]))
+        return self.ids[idx], chord_to_meters(chord)
+    
+    
+def get_node_index(graph = None):
+    """
+    get the NodeIndex of graph, build it at the first call. Default graph is G
+    """
+    graph = get_walk_graph() if graph is None else graph
+    if graph not in node_indexes:
+        node_indexes[graph] = NodeIndex(graph)
+    return node_indexes[graph]
+
+
+def find_nearest_points(points, graph = None):
+    """
+    get the nearest nodes of all points in one query
+    points( list((lat,lng)) )
+    graph( networkx graph ) : Default is G
+    return (array of node ids, array of distances in meters)
+    """
+    graph = get_walk_graph() if graph is None else graph
+    
+    # scipy is not installed, use osmnx for each point
+    if cKDTree is None:
+        result = [ox.get_nearest_node(graph, point, method = 'greatcircle', return_dist = True) 
+                  for point in points]
+        return np.array([r[0] for r in result]), np.array([r[1] for r in result])
+    
+    return get_node_index(graph).query(points)
+
+
+def snap_houses(gdf, houses, points = None):
+    """
+    snap all houses to the nearest node of G in one query, and save them into snap_cache
+    gdf( GEOdataframe )
+    houses( list(id) ) : houses id
+    points( dict{id : (lat,lng)} ) : the point of each house, e.g. from geocode_houses.
+                                     Default is None, use the centroid
+    return dict{id : (node id, distance in meters)}
+    """
+    houses = [i for i in houses if points is None or i in points]
+    if points is None:
+        # centroid is (lng,lat)
+        points = {i : (gdf['centroid'][i].coords[0][1], gdf['centroid'][i].coords[0][0]) for i in houses}
+    if len(houses) == 0:
+        return {}
+    
+    nearest, dis = find_nearest_points([points[i] for i in houses])
+    for i, node, d in zip(houses,nearest,dis):
+        snap_cache[points[i]] = (node, d)
+    return {i : (node, d) for i, node, d in zip(houses,nearest,dis)}
+
+
+
+################################################################################
+#
+# Influence Index
+#       for each occupied house, the vacant houses within max_d_e sorted by 
+#       distance ( CSR form ), with the cumulative weights of affect_OSMNX.
+#       the influence row and the normalizer total of model 2 for any 
+#       d_e <= max_d_e are prefix slices, so a sweep over d_e computes the
+#       distances only once
+#
+################################################################################
+
+class InfluenceIndex(object):
+    """
+    gdf( GEOdataframe )
+    CompareHouses( list((id_1,id_2)) ) : pairs of occupied houses id and vacant houses id, 
+                                         see OSMNX_Map.GetCompareHousesSet_OSMNX
+    max_d_e( float ) : the maximum effective distance of interest in meters
+    powers( list(int) ) : the powers of affect_OSMNX computed at the beginning, others are computed when needed
+    
+        occupied, vacant : the sets of occupied and vacant houses id, see matches
+        row[o] : the row number of occupied house o
+        indptr : the vacant houses of row n are indices[indptr[n]:indptr[n+1]]
+        indices : vacant houses id
+        distance : the distance of each pair in meters, sorted in each row
+        cumsum[power] : the cumulative sum of weights 1/distance**power in each row
+    """
+    def __init__(self, gdf, CompareHouses, max_d_e, powers = [0,1,2]):
+        self.max_d_e = max_d_e
+        occupied = np.unique([item[0] for item in CompareHouses])
+        vacant = np.unique([item[1] for item in CompareHouses])
+        self.occupied = frozenset(occupied.tolist())
+        self.vacant = frozenset(vacant.tolist())
+        
+        # (lat,lng) of each house, centroid is (lng,lat)
+        point = lambda houses: np.array([(gdf['centroid'][i].coords[0][1], gdf['centroid'][i].coords[0][0]) 
+                                         for i in houses]).reshape(-1,2)
+        point_o = point(occupied)
+        point_v = point(vacant)
+        
+        # the vacant houses within max_d_e from a KD-tree, chord = 2*sin(d/2R)
+        if cKDTree is not None and len(vacant) != 0:
+            tree = cKDTree(to_unit_sphere(point_v[:,0],point_v[:,1]))
+            chord = 2.0*math.sin(min(max_d_e/2.0/EARTH_RADIUS,math.pi/2))*(1+1e-9)
+            close = tree.query_ball_point(to_unit_sphere(point_o[:,0],point_o[:,1]), chord)
+        else:
+            close = [range(len(vacant)) for o in occupied]
+            
+        self.row = {}
+        indptr = [0]
+        indices = []
+        distance = []
+        for n in xrange(len(occupied)):
+            j = np.array(close[n], dtype = int)
+            dis = distance_OSMNX(point_o[n], (point_v[j,0], point_v[j,1])) if len(j) != 0 else np.zeros(0)
+            keep = np.argsort(dis)
+            keep = keep[dis[keep] <= max_d_e]
+            
+            self.row[occupied[n]] = n
+            indices.append(vacant[j[keep]])
+            distance.append(dis[keep])
+            indptr.append(indptr[-1] + len(keep))
+            
+        self.indptr = np.array(indptr)
+        self.indices = np.concatenate(indices) if len(indices) != 0 else np.zeros(0, dtype = int)
+        self.distance = np.concatenate(distance) if len(distance) != 0 else np.zeros(0)
+        
+        self.cumsum = {}
+        for power in powers:
+            self.get_cumsum(power)
+            
+    def matches(self, occupied, vacant):
+        """
+        return True if the index is built for the same occupied and vacant houses
+        """
+        return self.occupied == frozenset(occupied) and self.vacant == frozenset(vacant)
+    
+    def get_cumsum(self, power):
+        """
+        return the cumulative weights of each row for power, same as affect_OSMNX
+        """
+        if power not in self.cumsum:
+            weight = 1.0/self.distance**power
+            cumsum = np.cumsum(weight)
+            # restart the sum at the beginning of each row
+            offset = np.concatenate(([0.0], cumsum))[self.indptr[:-1]]
+            self.cumsum[power] = cumsum - np.repeat(offset, np.diff(self.indptr))
+        return self.cumsum[power]
+    
+    def get_slice(self, o, d_e):
+        """
+        return (start, end) of the vacant houses within d_e of occupied house o
+        """
+        n = self.row[o]
+        start = self.indptr[n]
+        return start, start + np.searchsorted(self.distance[start:self.indptr[n+1]], d_e, side = 'right')
+    
+    def get_weights(self, o, d_e, power = 1):
+        """
+        return dict{v : weight} of the vacant houses within d_e of occupied house o
+        """
+        start, end = self.get_slice(o, d_e)
+        return dict(zip(self.indices[start:end], 1.0/self.distance[start:end]**power))
+    
+    def get_total(self, o, d_e, power = 1):
+        """
+        return the normalizer total of occupied house o, the sum of weights within d_e
+        """
+        start, end = self.get_slice(o, d_e)
+        return self.get_cumsum(power)[end-1] if end > start else 0.0
+    
+    
+    
+################################################################################
+#
+# Batch Geocoding
+#       ox.utils.geocode sends one request to Nominatim per call, and 
+#       geometry_distance needs two of them for every pair of houses.
+#       geocode_houses collects the distinct addresses first and resolves them
+#       with a thread pool under a rate limit, then geometry_distance reads
+#       the coordinates from geocode_cache
+#       the thread pool and the caches live in geocoding.py, which does not
+#       need osmnx or gurobipy
+#
+################################################################################
+
+from geocoding import geocode_cache, geocode_failed, geocode, RateLimiter, geocode_retry, geocode_batch
+
+
+def get_address(gdf,i):
+    """
+    get the address of house i - "housenumber street, city, state"
+    return None if any part of the address is missing
+    """
+    parts = [gdf[column][i] for column in ['addr:housenumber','addr:street','addr:city','addr:state']]
+    if any(pd.isnull(part) for part in parts):
+        return None
+    return parts[0] + " " + parts[1] + ", " + parts[2] + ", " + parts[3]
+
+
+def geocode_houses(gdf, houses, **kwargs):
+    """
+    geocode all houses in one batch
+    gdf( GEOdataframe )
+    houses( list(id) ) : houses id
+    kwargs : see geocode_batch
+    
+    return dict{id : (lat,lng)}, houses without address or failed are not included
+    """
+    address = {i : get_address(gdf,i) for i in houses}
+    points = geocode_batch(address.values(), **kwargs)
+    return {i : points[a] for i, a in address.items() if a is not None and points[a] is not None}
+
+
+
+################################################################################
+#
+# Result Store
+#       solved plans on disk, keyed by a hash of the inputs ( houses, edges,
+#       price, model options and gurobi version ), so the same scenario is 
+#       only built and solved once, see ILP_sol.solve and run_scenarios
+#
+################################################################################
+
+def static_key(gdf, Houses, Edge):
+    """
+    return a stable hash of the inputs which do not change with the scenario : 
+    houses, centroids, edges and gurobi version
+    gdf( GEOdataframe ), Houses( list(id) ), Edge( list((id_1,id_2)) ) : see ILP_sol
+    """
+    # centroid is (lng,lat)
+    centroid = np.round([gdf['centroid'][i].coords[0] for i in Houses], 7)
+    
+    sha = hashlib.sha1()
+    sha.update(repr(list(Houses)))
+    sha.update(centroid.tobytes())
+    sha.update(repr(sorted(Edge)))
+    sha.update(repr(gurobi.version()))
+    return sha.hexdigest()
+
+
+def pairs_key(options):
+    """
+    return a hash of CompareHouses if the model uses each pair ( delta method with model 1 ), 
+    otherwise None, the other models only use the occupied and vacant houses sets
+    options( dict ) : arguments of ILP_sol.update_model_OSMNX
+    """
+    if options['delta_method'] and options['model'] == 1:
+        return hashlib.sha1(repr(sorted(options['CompareHouses']))).hexdigest()
+    return None
+
+
+def result_key(static, gdf, Houses, occupied, vacant, price, options, storytype = None):
+    """
+    return a stable hash of the inputs of a model
+    static( string ) : see static_key
+    gdf( GEOdataframe ), Houses( list(id) ) : see ILP_sol
+    occupied( list(id) ), vacant( list(id) ) : the occupied and vacant houses of the model
+    price( dict ) : see ILP_sol.get_price
+    options( dict ) : arguments of ILP_sol.update_model_OSMNX, functions are identified by name
+                      CompareHouses is replaced by pairs_key
+    storytype( array ) : storytype of each row of gdf. Default is None, use gdf['storytype']
+    """
+    storytype = gdf['storytype'] if storytype is None else pd.Series(storytype, index = gdf.index)
+    
+    sha = hashlib.sha1(static)
+    sha.update(repr(gdf['housetype'][Houses].tolist()))
+    sha.update(repr(storytype[Houses].tolist()))
+    sha.update(repr(sorted(occupied)))
+    sha.update(repr(sorted(vacant)))
+    sha.update(repr(sorted(price.items())))
+    sha.update(repr(sorted((name, getattr(value,'__name__',value)) for name, value in options.items())))
+    return sha.hexdigest()
+
+
+def get_defaults(function):
+    """
+    return dict of the default arguments of function
+    """
+    spec = inspect.getargspec(function)
+    return dict(zip(spec.args[-len(spec.defaults):], spec.defaults))
+
+
+class ResultStore(object):
+    """
+    one compressed numpy file ( .npz ) for each result
+        x : int8 array ordered as Houses
+        ObjVal, spent, Runtime : float
+    path( string ) : the folder of the store. Default is 'results'
+    max_bytes( int ) : the maximum size of the store, the least recently used results are removed first.
+                       Default is 100MB
+    """
+    def __init__(self, path = 'results', max_bytes = 100*1024*1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.isdir(path):
+            os.makedirs(path)
+            
+    def get_file(self, key):
+        return os.path.join(self.path, key + '.npz')
+    
+    def get(self, key):
+        """
+        return dict of the result, or None if the key is not in the store
+        """
+        name = self.get_file(key)
+        if not os.path.isfile(name):
+            return None
+        try:
+            data = np.load(name)
+            result = {item : data[item] for item in data.files}
+            data.close()
+        except (IOError, ValueError):
+            return None
+        
+        # mark as recently used
+        os.utime(name, None)
+        return result
+    
+    def put(self, key, x, ObjVal, spent, Runtime):
+        """
+        save the result, then remove the least recently used results if the store is too large
+        """
+        name = self.get_file(key)
+        # write into a temp file first, rename is atomic for other processes
+        temp = '%s.%s.tmp' %(name, os.getpid())
+        with open(temp, 'wb') as f:
+            np.savez_compressed(f, x = np.round(x).astype(np.int8), ObjVal = ObjVal, spent = spent, 
+                                Runtime = Runtime)
+        os.rename(temp, name)
+        self.evict()
+        
+    def evict(self):
+        files = [os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith('.npz')]
+        files = sorted((os.path.getmtime(name), os.path.getsize(name), name) for name in files)
+        total = sum(item[1] for item in files)
+        for mtime, size, name in files:
+            if total <= self.max_bytes:
+                break
+            os.remove(name)
+            total -= size
+            
+            
+
+################################################################################
+#
+# Scenario Runner
+#       run the same model over many random storytype vectors
+#       each worker process builds ILP_sol once, then only the budget 
+#       constraint is changed for each scenario, see ILP_sol.set_storytype
+#
+################################################################################
+
+# _scenario : ILP_sol of the worker process, see _initial_scenario
+_scenario = None
+
+
+def storytype_scenarios(n, seeds):
+    """
+    generate random storytype ( 2 or 3 ) vectors
+    n( int ) : the number of rows of gdf
+    seeds( list(int) ) : one seed for each scenario, None for an unseeded scenario
+    return array (len(seeds),n), the row of seed s is the same as OSMNX_Map(seed = s)
+    """
+    # seed None uses the global random state as before
+    return np.vstack([(np.random if seed is None else np.random.RandomState(seed)).randint(2,4,size = n) 
+                      for seed in seeds])
+
+
+def _initial_scenario(gdf, Houses, Edge, CompareHouses, price, options):
+    """
+    build the model once in each worker process
+    """
+    global _scenario
+    # a new gurobi environment, the one inherited from the parent process by fork must not be used
+    _scenario = ILP_sol(Houses, Edge, gdf, env = Env())
+    _scenario.initial_price(**price)
+    _scenario.update_model_OSMNX(CompareHouses = CompareHouses, **options)
+    # one thread for each worker process
+    _scenario.model.Params.OutputFlag = 0
+    _scenario.model.Params.Threads = 1
+    
+    
+def _solve_scenario(storytype):
+    """
+    solve one scenario in the worker process
+    return (x, ObjVal, spent, Runtime, Status), x is ordered as Houses
+    """
+    _scenario.set_storytype(storytype)
+    _scenario.solve()
+    x = np.array([_scenario.x[i].X for i in _scenario.Houses])
+    return x, _scenario.model.ObjVal, _scenario.get_spent(), _scenario.model.Runtime, _scenario.model.Status
+
+
+def run_scenarios(gdf, Houses, Edge, CompareHouses, seeds, processes = None, price = {}, 
+                  quantiles = [5,25,50,75,95], store = None, **options):
+    """
+    solve one scenario for each seed in parallel worker processes
+    gdf( GEOdataframe ), Houses( list(id) ), Edge( list((id_1,id_2)) ) : see ILP_sol
+    CompareHouses( list((id_1,id_2)) ) : see ILP_sol.update_model_OSMNX
+    seeds( list(int) ) : one seed for each scenario, see storytype_scenarios
+    processes( int ) : the number of worker processes. Default is None, the number of cpus
+                       at most one worker process for each scenario to solve
+    price( dict ) : arguments of ILP_sol.initial_price, e.g. {'Budget' : 500000}
+    quantiles( list(int) ) : the quantiles of objective and spent budget in percent
+    store( ResultStore ) : Default is None. If given, only the scenarios not in the store are solved,
+                           and the worker processes are not started if all of them are stored
+    options : arguments of ILP_sol.update_model_OSMNX. Default d is distance_OSMNX, h is affect_OSMNX
+    
+    return dict
+        'frequency' : dict{id : demolition frequency of the house}
+        'x' : array (len(seeds),len(Houses)), the solution of each scenario
+        'ObjVal', 'spent', 'Runtime', 'Status' : array of each scenario, stored results are GRB.OPTIMAL
+        'ObjVal_quantiles', 'spent_quantiles' : dict{q : value}
+    """
+    options.setdefault('d', distance_OSMNX)
+    options.setdefault('h', affect_OSMNX)
+    storytype = storytype_scenarios(len(gdf.index), seeds)
+    results = [None]*len(storytype)
+    
+    # look up the result store first
+    if store is not None:
+        # fill in the default arguments, same as ILP_sol.get_price and ILP_sol.options
+        full_price = get_defaults(ILP_sol.initial_price)
+        full_price.update(price)
+        full_options = get_defaults(ILP_sol.update_model_OSMNX)
+        full_options.update(options)
+        full_options['CompareHouses'] = CompareHouses
+        # same as ILP_sol.pairs, the pairs are only hashed for model 1
+        full_options['CompareHouses'] = pairs_key(full_options)
+        # the neighbor index and the geocode settings are not inputs of the result
+        full_options.pop('index')
+        full_options.pop('geocode_options')
+        
+        # same key as ILP_sol.get_key without no good constraints, only the storytype changes
+        static = static_key(gdf, Houses, Edge)
+        occupied = np.unique([item[0] for item in CompareHouses]).tolist()
+        vacant = np.unique([item[1] for item in CompareHouses]).tolist()
+        keys = [hashlib.sha1(result_key(static, gdf, Houses, occupied, vacant, full_price, full_options, row) 
+                             + repr([])).hexdigest()
+                for row in storytype]
+        for n in xrange(len(keys)):
+            result = store.get(keys[n])
+            if result is not None:
+                results[n] = (result['x'], float(result['ObjVal']), float(result['spent']), 
+                              float(result['Runtime']), GRB.OPTIMAL)
+                
+    missing = [n for n in xrange(len(results)) if results[n] is None]
+    if len(missing) != 0:
+        # no more worker processes than scenarios, each worker builds its own model
+        processes = min(processes or multiprocessing.cpu_count(), len(missing))
+        pool = multiprocessing.Pool(processes, initializer = _initial_scenario,
+                                    initargs = (gdf, Houses, Edge, CompareHouses, price, options))
+        try:
+            solved = pool.map(_solve_scenario, [storytype[n] for n in missing])
+        finally:
+            pool.close()
+            pool.join()
+            
+        for n, result in zip(missing, solved):
+            results[n] = result
+            # only optimal solutions are stored, see ILP_sol.solve
+            if store is not None and result[4] == GRB.OPTIMAL:
+                store.put(keys[n], *result[:4])
+        
+    x = np.array([r[0] for r in results])
+    ObjVal = np.array([r[1] for r in results])
+    spent = np.array([r[2] for r in results])
+    
+    return {'seeds' : list(seeds),
+            'x' : x,
+            'frequency' : dict(zip(Houses, x.mean(axis = 0))),
+            'ObjVal' : ObjVal,
+            'spent' : spent,
+            'Runtime' : np.array([r[3] for r in results]),
+            'Status' : np.array([r[4] for r in results]),
+            'ObjVal_quantiles' : dict(zip(quantiles, np.percentile(ObjVal, quantiles))),
+            'spent_quantiles' : dict(zip(quantiles, np.percentile(spent, quantiles)))}
+
+
+
+
+################################################################################
+#
+# What-if Service
+#       keep the map and the models in memory, answer what-if queries over HTTP
+#       each query only changes the budget rhs, the upper bounds of excluded
+#       houses or the bigM coefficients ( d_e ), then re-solve from the
+#       previous solution
+#
+#       POST / {"Budget" : 400000, "exclude" : [id, ...], "d_e" : 120}
+#       missing fields are the values the service is started with
+#
+################################################################################
+
+def check_query(query, Houses):
+    """
+    raise TypeError or ValueError if the query is not valid, see what_if
+    Budget and d_e are numbers, exclude is a list of houses id
+    """
+    if not isinstance(query, dict):
+        raise TypeError("the query must be a JSON object")
+    unknown = set(query) - set(['Budget', 'exclude', 'd_e'])
+    if len(unknown) != 0:
+        raise ValueError("unknown fields : %s" %sorted(unknown))
+    
+    # bool is a subclass of int
+    number = lambda value: isinstance(value, (int, long, float)) and not isinstance(value, bool)
+    for name in ['Budget', 'd_e']:
+        if name in query and not number(query[name]):
+            raise TypeError("%s must be a number" %name)
+    if 'd_e' in query and query['d_e'] <= 0:
+        raise ValueError("d_e must be positive")
+    
+    if 'exclude' in query:
+        exclude = query['exclude']
+        if not isinstance(exclude, list) or not all(isinstance(i, (int, long)) and not isinstance(i, bool) 
+                                                    for i in exclude):
+            raise TypeError("exclude must be a list of houses id")
+        unknown = set(exclude) - set(Houses)
+        if len(unknown) != 0:
+            raise ValueError("unknown houses : %s" %sorted(unknown))
+            
+            
+def what_if(sol, query, baseline):
+    """
+    answer one query with the model sol
+    sol( ILP_sol ) : a model solved at least once, the solution may be from the result store
+    query( dict ) : 'Budget', 'exclude' and 'd_e', all optional
+    baseline( dict ) : 'Budget' and 'd_e' when they are not in the query
+    return dict of the plan
+    """
+    # reject an invalid query before the model is changed
+    check_query(query, sol.Houses)
+    
+    # keep the previous solution before changing the model
+    start = sol.get_solution() if sol.solution is not None or sol.model.SolCount > 0 else {}
+    
+    sol.set_Budget(query.get('Budget', baseline['Budget']))
+    sol.set_excluded(query.get('exclude', []))
+    d_e = query.get('d_e', baseline['d_e'])
+    if d_e != sol.d_e:
+        sol.set_effective_distance(d_e)
+        
+    # warm start
+    for i in start:
+        sol.x[i].Start = 0 if i in sol.excluded else start[i]
+    sol.solve()
+    
+    # from the model or from the result store
+    result = sol.get_result()
+    x = result['x']
+    return {'demolish' : [int(i) for i in sol.Houses if x[i] == 1 or abs(x[i] - 1.0) < 0.000001],
+            'ObjVal' : result['ObjVal'],
+            'spent' : result['spent'],
+            'Runtime' : result['Runtime'],
+            'Budget' : sol.Budget,
+            'd_e' : sol.d_e,
+            'exclude' : sorted(int(i) for i in sol.excluded)}
+
+
+class WhatIfServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server with a pool of models
+    models( list(ILP_sol) ) : one model for each concurrent solve
+    baseline( dict ) : see what_if
+    queue_size( int ) : the maximum number of waiting queries, more queries are rejected with 503
+    timeout( float ) : the maximum waiting time of a query in seconds
+    """
+    daemon_threads = True
+    
+    def __init__(self, address, models, baseline, queue_size = 8, timeout = 60):
+        HTTPServer.__init__(self, address, WhatIfHandler)
+        self.models = Queue.Queue()
+        for sol in models:
+            self.models.put(sol)
+        self.baseline = baseline
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.waiting = 0
+        self.lock = threading.Lock()
+        
+    def answer(self, query):
+        """
+        return (http status, dict)
+        """
+        with self.lock:
+            if self.waiting >= self.queue_size:
+                return 503, {'error' : 'too many queries'}
+            self.waiting += 1
+        try:
+            sol = self.models.get(timeout = self.timeout)
+        except Queue.Empty:
+            return 503, {'error' : 'timeout'}
+        finally:
+            with self.lock:
+                self.waiting -= 1
+                
+        try:
+            return 200, what_if(sol, query, self.baseline)
+        except (GurobiError, KeyError, TypeError, ValueError) as e:
+            return 400, {'error' : str(e)}
+        finally:
+            self.models.put(sol)
+            
+            
+class WhatIfHandler(BaseHTTPRequestHandler):
+    
+    def do_POST(self):
+        try:
+            length = int(self.headers.getheader('content-length', 0))
+            query = json.loads(self.rfile.read(length) or '{}')
+        except ValueError as e:
+            code, answer = 400, {'error' : str(e)}
+        else:
+            code, answer = self.server.answer(query)
+            
+        body = json.dumps(answer)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        
+        
+def serve(m, host = '127.0.0.1', port = 8050, solvers = 1, queue_size = 8, timeout = 60, price = {}, 
+          **options):
+    """
+    build the models of the map m once, then answer what-if queries until interrupted
+    m( OSMNX_Map )
+    host( string ), port( int ) : the address of the service. Default is 127.0.0.1:8050
+    solvers( int ) : the number of models, i.e. the number of concurrent solves. Default is 1
+    queue_size( int ), timeout( float ) : see WhatIfServer
+    price( dict ) : arguments of ILP_sol.initial_price, e.g. {'Budget' : 500000}
+    options : arguments of ILP_sol.update_model_OSMNX. Default d is distance_OSMNX, h is affect_OSMNX
+    """
+    options.setdefault('d', distance_OSMNX)
+    options.setdefault('h', affect_OSMNX)
+    CompareHouses = m.GetCompareHousesSet_OSMNX()
+    
+    models = []
+    for n in xrange(solvers):
+        # one gurobi environment for each model, they are solved in different threads
+        sol = ILP_sol(m.Houses, m.Edge, m.gdf, env = Env())
+        sol.initial_price(**price)
+        sol.update_model_OSMNX(CompareHouses = CompareHouses, **options)
+        sol.model.Params.OutputFlag = 0
+        # the first solve is the warm start of the first query
+        sol.solve()
+        models.append(sol)
+        
+    baseline = {'Budget' : models[0].Budget, 'd_e' : models[0].d_e}
+    server = WhatIfServer((host, port), models, baseline, queue_size, timeout)
+    print "what-if service on %s:%s" %(host, port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    # python CTILP_optimization.py --radius 550 --budget 500000 --d_e 60
+    import argparse
+    parser = argparse.ArgumentParser(description = 'what-if planning service')
+    parser.add_argument('--address', default = '1516 Kenhill Ave, Baltimore, MD')
+    parser.add_argument('--radius', type = int, default = 550)
+    parser.add_argument('--budget', type = float, default = 500000)
+    parser.add_argument('--d_e', type = float, default = 60)
+    parser.add_argument('--power', type = int, default = 1)
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8050)
+    parser.add_argument('--solvers', type = int, default = 1)
+    args = parser.parse_args()
     
+    serve(OSMNX_Map(address = args.address, radius = args.radius, same = True), 
+          host = args.host, port = args.port, solvers = args.solvers, price = {'Budget' : args.budget}, 
+          d_e = args.d_e, power = args.power, model = 2)
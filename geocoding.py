@@ -0,0 +1,113 @@
+################################################################################
+#
+# Module: geocoding.py
+# Description: batch geocoding for CTILP_optimization - distinct addresses are
+#              resolved once with a thread pool under a rate limit and kept in
+#              geocode_cache, failed addresses are kept in geocode_failed
+#              only the standard library is needed, osmnx is imported when the
+#              default geocoder is used
+# Auther: Lenny Fan (Chi-Wen Fan)
+################################################################################
+
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+
+# geocode_cache : dict{address(string) : (lat,lng)} - resolved addresses
+geocode_cache = {}
+# geocode_failed : set(address(string)) - addresses failed after all retries
+geocode_failed = set()
+
+
+def default_geocoder(address):
+    """
+    geocode an address with Nominatim, see ox.utils.geocode
+    """
+    import osmnx as ox
+    return ox.utils.geocode(address)
+
+
+def geocode(address):
+    """
+    geocode a single address, use geocode_cache if the address is resolved before
+    return None if the address is missing or failed before, failed addresses are not requested again
+    """
+    if address is None or address in geocode_failed:
+        return None
+    if address not in geocode_cache:
+        try:
+            geocode_cache[address] = default_geocoder(address)
+        except Exception as e:
+            print "geocode failed : %s ( %s )" %(address,e)
+            geocode_failed.add(address)
+            return None
+    return geocode_cache[address]
+
+
+class RateLimiter(object):
+    """
+    allow at most `rate` calls of wait() per second over all threads
+    """
+    def __init__(self, rate = 1.0):
+        self.interval = 1.0/rate if rate > 0 else 0.0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+        
+    def wait(self):
+        # reserve the next time slot, then sleep outside of the lock
+        with self.lock:
+            now = time.time()
+            delay = self.next_time - now
+            self.next_time = max(now,self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+            
+            
+def geocode_retry(address, limiter, geocoder = None, retries = 3, backoff = 2.0):
+    """
+    geocode one address under the rate limiter
+    retry with exponential backoff ( backoff*2**attempt seconds ), return None if all attempts fail
+    """
+    geocoder = default_geocoder if geocoder is None else geocoder
+    for attempt in xrange(retries+1):
+        limiter.wait()
+        try:
+            return geocoder(address)
+        except Exception as e:
+            if attempt == retries:
+                print "geocode failed : %s ( %s )" %(address,e)
+                return None
+            time.sleep(backoff*2**attempt)
+            
+            
+def geocode_batch(addresses, rate = 1.0, workers = 4, retries = 3, backoff = 2.0, geocoder = None):
+    """
+    geocode a list of addresses, each distinct address is requested only once
+    addresses( list(string) ) : addresses, duplicates and None are allowed
+    rate( float ) : the maximum number of requests per second. Default is 1 ( Nominatim usage policy )
+    workers( int ) : the number of concurrent requests. Default is 4
+    retries( int ) : the number of retries for a failed request. Default is 3
+    backoff( float ) : the first backoff in seconds, doubled after each retry. Default is 2.0
+    geocoder( func() ) : address -> (lat,lng). Default is ox.utils.geocode
+    
+    return dict{address : (lat,lng)}, failed addresses map to None and are saved into geocode_failed
+    """
+    distinct = [a for a in set(addresses) if a is not None and a not in geocode_cache and a not in geocode_failed]
+    
+    if len(distinct) != 0:
+        limiter = RateLimiter(rate)
+        pool = ThreadPool(max(1,min(workers,len(distinct))))
+        try:
+            points = pool.map(lambda a: geocode_retry(a, limiter, geocoder, retries, backoff), distinct)
+        finally:
+            pool.close()
+            pool.join()
+            
+        for address, point in zip(distinct,points):
+            if point is not None:
+                geocode_cache[address] = point
+            else:
+                geocode_failed.add(address)
+                
+    return {a : geocode_cache.get(a) for a in set(addresses) if a is not None}
@@ -0,0 +1,103 @@
+################################################################################
+#
+# Test: the max-min distance model ( delta_method = False ) on synthetic houses
+#       the k nearest candidates with lazy constraints give the same optimum
+#       as the full model
+#       python -m unittest discover tests
+#
+################################################################################
+
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def import_ctilp():
+    """
+    import CTILP_optimization from a temporary folder with an empty vacantosmnx file
+    return None if osmnx, gurobipy or the other dependencies are missing
+    """
+    cwd = os.getcwd()
+    folder = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(folder, 'vacantosmnx'), 'wb') as f:
+            csv.writer(f).writerow([0])
+        os.chdir(folder)
+        import CTILP_optimization
+        # gurobipy without a license fails when the first model is created
+        CTILP_optimization.Model().dispose()
+        return CTILP_optimization
+    except Exception:
+        return None
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder)
+
+
+ctilp = import_ctilp()
+
+
+@unittest.skipIf(ctilp is None, 'CTILP_optimization needs osmnx, gurobipy and a gurobi license')
+class DistanceModelTest(unittest.TestCase):
+
+    def setUp(self):
+        import numpy as np
+        import pandas as pd
+        from shapely import geometry
+
+        # 40 houses around ( 39.3, -76.6 ) within about 200 meters
+        random = np.random.RandomState(0)
+        n = 40
+        self.Houses = range(100, 100 + n)
+        lat = 39.3 + random.uniform(-0.002, 0.002, n)
+        lng = -76.6 + random.uniform(-0.002, 0.002, n)
+        # housetype 2 : vacant, 0 : renter
+        housetype = [2 if i % 3 == 0 else 0 for i in xrange(n)]
+        self.gdf = pd.DataFrame({'centroid' : [geometry.Point(lng[i], lat[i]) for i in xrange(n)],
+                                 'housetype' : housetype,
+                                 'storytype' : random.randint(2, 4, n)},
+                                index = self.Houses)
+        self.Edge = [(self.Houses[i], self.Houses[i+1]) for i in xrange(0, n - 1, 2)]
+        self.CompareHouses = [(o, v) for o in self.gdf[self.gdf['housetype'] == 0].index
+                                     for v in self.gdf[self.gdf['housetype'] == 2].index]
+
+    def solve(self, k, Budget):
+        sol = ctilp.ILP_sol(self.Houses, self.Edge, self.gdf)
+        sol.initial_price(Budget = Budget)
+        sol.model.Params.OutputFlag = 0
+        sol.update_model_OSMNX(ctilp.distance_OSMNX, ctilp.affect_OSMNX, self.CompareHouses,
+                               delta_method = False, k = k)
+        sol.solve()
+        self.assertEqual(sol.model.Status, ctilp.GRB.OPTIMAL)
+        return sol
+
+    def test_k_nearest_same_objective(self):
+        for Budget in [50000, 150000, 400000]:
+            full = self.solve(None, Budget)
+            pruned = self.solve(2, Budget)
+
+            self.assertIsNone(full.callback)
+            self.assertIsNotNone(pruned.callback)
+            self.assertAlmostEqual(pruned.model.ObjVal, full.model.ObjVal, delta = 1e-6*max(1.0, full.model.ObjVal))
+
+    def test_other_distance_uses_all_vacant_houses(self):
+        # a distance which is not the great circle distance is not pruned
+        manhattan = lambda x, y: (abs(x[0] - y[0]) + abs(x[1] - y[1]))*111000.0
+        sol = ctilp.ILP_sol(self.Houses, self.Edge, self.gdf)
+        sol.model.Params.OutputFlag = 0
+        sol.update_model_OSMNX(manhattan, ctilp.affect_OSMNX, self.CompareHouses, delta_method = False, k = 2)
+
+        self.assertIsNone(sol.callback)
+        vacant = set(v for o, v in self.CompareHouses)
+        for o in sol.occupied:
+            self.assertEqual(sol.candidates[o], vacant)
+            self.assertAlmostEqual(sol.M[o], max(manhattan(sol.point[o], sol.point[v]) for v in vacant))
+
+
+if __name__ == '__main__':
+    unittest.main()
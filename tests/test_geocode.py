@@ -0,0 +1,156 @@
+################################################################################
+#
+# Test: batch geocoding against a local stub geocoder
+#       python -m unittest discover tests
+#
+################################################################################
+
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+import urllib
+import urllib2
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import geocoding
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """
+    stub geocoder - GET /search?q=address returns [lat, lng]
+    latency( float ) : the response time in seconds
+    fail[address] : the number of 500 responses before the address succeeds
+    requests : list((time, address)) of all requests
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.latency = 0.0
+        self.fail = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        address = urllib.unquote_plus(self.path.split('q=', 1)[1])
+        with self.server.lock:
+            self.server.requests.append((time.time(), address))
+            failing = self.server.fail.get(address, 0) > 0
+            if failing:
+                self.server.fail[address] -= 1
+        time.sleep(self.server.latency)
+
+        if failing:
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = json.dumps([39.3, -76.6 - len(address)/1000.0])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class GeocodeBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        geocoding.geocode_cache.clear()
+        geocoding.geocode_failed.clear()
+        self.server = StubServer()
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%s/search?q=' %self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def geocoder(self, address):
+        return tuple(json.loads(urllib2.urlopen(self.url + urllib.quote_plus(address)).read()))
+
+    def times(self, address = None):
+        return sorted(t for t, a in self.server.requests if address is None or a == address)
+
+    def test_distinct_addresses(self):
+        addresses = ['1 A St', '2 B St', '1 A St', None, '3 C St', '2 B St'] * 3
+        points = geocoding.geocode_batch(addresses, rate = 1000, geocoder = self.geocoder)
+
+        self.assertEqual(sorted(points.keys()), ['1 A St', '2 B St', '3 C St'])
+        self.assertEqual(len(self.server.requests), 3)
+
+        # resolved addresses are read from geocode_cache
+        geocoding.geocode_batch(addresses, rate = 1000, geocoder = self.geocoder)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_rate_limit(self):
+        addresses = ['%s A St' %n for n in xrange(10)]
+        start = time.time()
+        geocoding.geocode_batch(addresses, rate = 10, workers = 4, geocoder = self.geocoder)
+
+        times = self.times()
+        self.assertEqual(len(times), 10)
+        # at most 10 requests per second
+        self.assertGreaterEqual(time.time() - start, 0.9*0.95)
+        for first, second in zip(times, times[1:]):
+            self.assertGreaterEqual(second - first, 0.1*0.8)
+
+    def test_concurrency_speedup(self):
+        self.server.latency = 0.2
+        addresses = ['%s A St' %n for n in xrange(8)]
+
+        start = time.time()
+        geocoding.geocode_batch(addresses, rate = 1000, workers = 1, geocoder = self.geocoder)
+        sequential = time.time() - start
+
+        geocoding.geocode_cache.clear()
+        start = time.time()
+        geocoding.geocode_batch(addresses, rate = 1000, workers = 8, geocoder = self.geocoder)
+        concurrent = time.time() - start
+
+        self.assertGreaterEqual(sequential, 8*0.2)
+        self.assertLess(concurrent, sequential/3)
+
+    def test_retry_backoff(self):
+        self.server.fail['1 A St'] = 2
+        points = geocoding.geocode_batch(['1 A St'], rate = 1000, retries = 3, backoff = 0.05,
+                                         geocoder = self.geocoder)
+
+        self.assertIsNotNone(points['1 A St'])
+        times = self.times('1 A St')
+        self.assertEqual(len(times), 3)
+        # backoff 0.05 then 0.1 seconds
+        self.assertGreaterEqual(times[1] - times[0], 0.05)
+        self.assertGreaterEqual(times[2] - times[1], 0.1)
+
+    def test_failed_address(self):
+        self.server.fail['1 A St'] = 10
+        points = geocoding.geocode_batch(['1 A St', '2 B St'], rate = 1000, retries = 1, backoff = 0.01,
+                                         geocoder = self.geocoder)
+
+        self.assertIsNone(points['1 A St'])
+        self.assertIsNotNone(points['2 B St'])
+        self.assertEqual(len(self.times('1 A St')), 2)
+        self.assertIn('1 A St', geocoding.geocode_failed)
+
+        # failed addresses are not requested again
+        geocoding.geocode_batch(['1 A St'], rate = 1000, geocoder = self.geocoder)
+        self.assertIsNone(geocoding.geocode('1 A St'))
+        self.assertEqual(len(self.times('1 A St')), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()